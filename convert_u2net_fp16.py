@@ -0,0 +1,26 @@
+"""
+Convert rembg's FP32 U²-Net model to FP16 for the CUDA/TensorRT providers.
+
+Run once offline, then point the server at the converted file:
+
+    python convert_u2net_fp16.py
+    REMBG_DEVICE=tensorrt REMBG_MODEL_PATH=~/.u2net/u2net_fp16.onnx python server.py
+
+Inputs and outputs stay float32 so the server's preprocessing is unchanged.
+"""
+import os
+
+import onnx
+from onnxconverter_common import float16
+from rembg.sessions.u2net import U2netSession
+
+# Step 1: Locate (and download if needed) the FP32 model rembg uses
+source_path = U2netSession.download_models()
+output_path = os.path.join(os.path.dirname(source_path), "u2net_fp16.onnx")
+
+# Step 2: Convert weights and activations to FP16
+model = onnx.load(source_path)
+model_fp16 = float16.convert_float_to_float16(model, keep_io_types=True)
+onnx.save(model_fp16, output_path)
+
+print(f"✅ Converted '{source_path}' → '{output_path}'")
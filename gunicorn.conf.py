@@ -0,0 +1,27 @@
+"""
+Gunicorn settings for the background removal server.
+
+Usage:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Requests are served by threaded workers so uploads are handled concurrently
+and can share U²-Net batches. A single process is used by default: on CUDA it
+owns the GPU session, and on CPU onnxruntime already spreads each batch over
+every core, so more processes would only split batches and oversubscribe the
+CPU. Raising WEB_CONCURRENCY divides the cores between the processes' sessions.
+
+The app is deliberately not preloaded: the onnxruntime session and the
+mask-batcher thread do not survive a fork, so each worker loads its own.
+"""
+import os
+
+# Use port 5045 to avoid conflict with macOS AirPlay Receiver on port 5000
+bind = f"0.0.0.0:{os.environ.get('PORT', '5045')}"
+
+worker_class = "gthread"
+
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+threads = 8 if os.environ.get("REMBG_DEVICE", "cuda").lower() == "cpu" else 16
+
+# The first start may download the U²-Net model or build a TensorRT engine
+timeout = 600
@@ -1,17 +1,21 @@
 from transformers import AutoModelForImageClassification, AutoImageProcessor
 from PIL import Image
-import numpy as np
-import cv2
 import os
-from rembg import remove
+from concurrent.futures import ThreadPoolExecutor
+from rembg import new_session, remove
 import torch
+from torchvision.transforms import InterpolationMode, v2 as T
 
 # Configuration
 IMAGE_SIZE = (224, 224)  # Model expects 224x224
 MODEL_NAME = "microsoft/swin-tiny-patch4-window7-224"  # Pre-trained model
 OUTPUT_DIR = "processed_images"
+BATCH_SIZE = 32  # Images per forward pass in classify_batch
 DB = []  # Simple list to simulate database for clothing registration
 
+# Background removal session, created once and shared by every call
+SESSION = new_session("u2net")
+
 # Ensure output directory exists
 if not os.path.exists(OUTPUT_DIR):
     os.makedirs(OUTPUT_DIR)
@@ -23,45 +27,88 @@ def load_model_and_processor():
     model.eval()  # Set to evaluation mode
     return model, processor
 
-# Preprocess image for classification
-def preprocess_image(image_path, processor):
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"Could not load image: {image_path}")
-    img = cv2.resize(img, IMAGE_SIZE)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)  # Convert to RGB
-    img = Image.fromarray(img)
-    inputs = processor(images=img, return_tensors="pt")
-    return inputs
+# Load the classifier once at import; on CUDA run it in FP16
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+MODEL, PROCESSOR = load_model_and_processor()
+MODEL = MODEL.to(DEVICE)
+if DEVICE == "cuda":
+    MODEL = MODEL.half()
+
+# PIL resample filters the processor may use, as torchvision interpolation modes
+RESAMPLE_MODES = {
+    Image.Resampling.NEAREST: InterpolationMode.NEAREST,
+    Image.Resampling.BILINEAR: InterpolationMode.BILINEAR,
+    Image.Resampling.BICUBIC: InterpolationMode.BICUBIC,
+}
+
+# Resize + dtype conversion + normalization as one module running on DEVICE;
+# the processor is only kept for the model's resample filter and mean/std.
+INPUT_DTYPE = torch.float16 if DEVICE == "cuda" else torch.float32
+TRANSFORM = torch.nn.Sequential(
+    T.Resize(
+        IMAGE_SIZE,
+        interpolation=RESAMPLE_MODES[int(PROCESSOR.resample)],
+        antialias=True,
+    ),
+    T.ToDtype(INPUT_DTYPE, scale=True),
+    T.Normalize(PROCESSOR.image_mean, PROCESSOR.image_std),
+)
+
+# Preprocess an already-opened PIL image into a (1, 3, 224, 224) tensor on DEVICE
+def preprocess_image(image):
+    if image.mode in ("RGB", "RGBA"):
+        # Slice off alpha from background-removed images instead of a PIL convert copy
+        img = T.functional.pil_to_tensor(image)[:3]
+    else:
+        img = T.functional.pil_to_tensor(image.convert("RGB"))
+    img = TRANSFORM(img.to(DEVICE))
+    return img.unsqueeze(0)
 
-# Remove background and save the processed image
-def remove_background(image_path, output_path):
+# Remove background and return the result in memory
+def remove_background(image_path, session=SESSION):
     input_img = Image.open(image_path)
-    output_img = remove(input_img)
-    output_img.save(output_path)
-    return output_path
+    return remove(input_img, session=session)
+
+# Classify PIL images in batches, one forward pass per BATCH_SIZE images
+def classify_batch(images, batch_size=BATCH_SIZE):
+    clothing_types = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        
+        # Preprocess every image and stack into one (B, 3, 224, 224) tensor
+        pixel_values = torch.cat([preprocess_image(image) for image in chunk])
+        
+        # Predict
+        with torch.inference_mode(), torch.autocast(DEVICE, dtype=torch.float16, enabled=DEVICE == "cuda"):
+            logits = MODEL(pixel_values=pixel_values).logits
+            predicted_classes = logits.argmax(-1).tolist()
+        
+        # Map prediction to shirt or pants (simplified, assumes binary mapping)
+        # Note: This model isn't fine-tuned, so we use a heuristic
+        clothing_types.extend(
+            "shirt" if predicted_class % 2 == 0 else "pants"  # Placeholder mapping
+            for predicted_class in predicted_classes
+        )
+    return clothing_types
 
 # Classify image and store result
 def classify_and_store(image_path, item_id):
     # Remove background
-    output_path = os.path.join(OUTPUT_DIR, f"no_bg_{os.path.basename(image_path)}")
-    processed_image_path = remove_background(image_path, output_path)
-    
-    # Load model and processor
-    model, processor = load_model_and_processor()
-    
-    # Preprocess image
-    inputs = preprocess_image(image_path, processor)
+    no_bg_image = remove_background(image_path)
     
-    # Predict
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits
-        predicted_class = logits.argmax(-1).item()
+    # Cutouts are RGBA, so always save as PNG whatever the input extension
+    stem, _ = os.path.splitext(os.path.basename(image_path))
+    processed_image_path = os.path.join(OUTPUT_DIR, f"no_bg_{stem}.png")
     
-    # Map prediction to shirt or pants (simplified, assumes binary mapping)
-    # Note: This model isn't fine-tuned, so we use a heuristic
-    clothing_type = "shirt" if predicted_class % 2 == 0 else "pants"  # Placeholder mapping
+    # Save in the background so classification doesn't wait on PNG encoding
+    with ThreadPoolExecutor(max_workers=1) as saver:
+        saved = saver.submit(no_bg_image.save, processed_image_path)
+        
+        # Classify the in-memory result as a batch of one
+        clothing_type = classify_batch([no_bg_image])[0]
+        
+        # Re-raise save errors so DB never records a path that wasn't written
+        saved.result()
     
     # Store in "database"
     clothing_item = {
@@ -0,0 +1,148 @@
+"""
+Micro-batching helper that groups concurrent U²-Net requests into one run.
+
+Flask serves each request on its own thread, so without batching every upload
+triggers a separate onnxruntime call with a batch of one. The batcher lets
+those threads hand their preprocessed tensors to a single background worker
+that stacks whatever arrived within a short window and runs them together.
+"""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
+
+import numpy as np
+import onnxruntime as ort
+
+
+class MaskBatcher:
+    """
+    Queue-backed worker that runs U²-Net on batches of pending tensors.
+
+    Usage:
+        >>> batcher = MaskBatcher(ort_session, max_batch=8)
+        >>> future = batcher.submit(tensor)  # tensor shaped (3, 320, 320)
+        >>> prediction = future.result()     # raw (320, 320) saliency map
+
+    The worker waits for the first request, then keeps collecting until either
+    `max_batch` tensors are queued or `max_wait` seconds have passed, so a lone
+    request is delayed by at most `max_wait`.
+
+    Only the first model output (the fused saliency map) is fetched. On CUDA
+    the input is written into a device buffer reused per batch size and bound
+    with IO binding, so onnxruntime neither allocates device memory per run
+    nor copies U²-Net's six side outputs back to the host.
+    """
+
+    def __init__(
+        self,
+        session: ort.InferenceSession,
+        max_batch: int = 8,
+        max_wait: float = 0.01,
+    ) -> None:
+        """
+        Start the background worker for the given onnxruntime session.
+
+        Args:
+            session: onnxruntime session running the U²-Net model.
+            max_batch: Upper bound on how many tensors share one run.
+            max_wait: Seconds to wait for more requests after the first one.
+        """
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.output_name = session.get_outputs()[0].name
+
+        # Models exported with a fixed batch dimension cannot be stacked past it
+        batch_dim = session.get_inputs()[0].shape[0]
+        if isinstance(batch_dim, int):
+            max_batch = min(max_batch, batch_dim)
+
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+
+        # IO binding is only worth it when inference runs on the GPU
+        on_gpu = "CUDAExecutionProvider" in session.get_providers()
+        self._device = "cuda" if on_gpu else None
+        self._binding = session.io_binding() if self._device else None
+        self._device_inputs: Dict[int, ort.OrtValue] = {}
+
+        self._queue: "queue.Queue[Tuple[np.ndarray, Future]]" = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run,
+            name="mask-batcher",
+            daemon=True,
+        )
+        self._worker.start()
+
+    def submit(self, tensor: np.ndarray) -> Future:
+        """
+        Queue a normalized `(3, 320, 320)` tensor for the next batch.
+
+        Returns:
+            Future resolving to the model's `(320, 320)` prediction.
+        """
+        future: Future = Future()
+        self._queue.put((tensor, future))
+        return future
+
+    def _collect(self) -> List[Tuple[np.ndarray, Future]]:
+        """
+        Block for one pending item, then drain more until the batch is full
+        or the wait window closes.
+        """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _infer(self, inputs: np.ndarray) -> np.ndarray:
+        """
+        Run one stacked batch and return the first model output on the host.
+        """
+        if self._binding is None:
+            return self.session.run([self.output_name], {self.input_name: inputs})[0]
+
+        device_input = self._device_inputs.get(len(inputs))
+        if device_input is None:
+            device_input = ort.OrtValue.ortvalue_from_shape_and_type(
+                inputs.shape, np.float32, self._device, 0
+            )
+            self._device_inputs[len(inputs)] = device_input
+        device_input.update_inplace(inputs)
+
+        self._binding.bind_ortvalue_input(self.input_name, device_input)
+        self._binding.bind_output(self.output_name, self._device)
+        self.session.run_with_iobinding(self._binding)
+        return self._binding.copy_outputs_to_cpu()[0]
+
+    def _run(self) -> None:
+        """
+        Worker loop: run each collected batch and resolve its futures.
+        """
+        while True:
+            batch = self._collect()
+            futures = [future for _, future in batch]
+
+            try:
+                inputs = np.stack([tensor for tensor, _ in batch])
+                output = self._infer(inputs)
+            except Exception as exc:
+                for future in futures:
+                    future.set_exception(exc)
+                continue
+
+            predictions = output[:, 0, :, :]
+            for future, prediction in zip(futures, predictions):
+                future.set_result(prediction)
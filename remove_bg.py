@@ -1,25 +1,29 @@
 import os
 import time
-from rembg import remove
+from multiprocessing import get_context
+from rembg import new_session, remove
 from PIL import Image
+from tqdm import tqdm
 
-# Step 1: Get all files that start with 'image' and are image files
-image_files = []
-valid_extensions = ('.jpg', '.jpeg', '.png', '.webp')
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.webp'})
 
-for filename in os.listdir():
-    if filename.lower() and filename.lower().endswith(valid_extensions):
-        image_files.append(filename)
+# rembg session of the current worker process, created once by _init_session
+SESSION = None
 
-# Print found image files
-print(f"🖼️ Found {len(image_files)} image(s): {image_files}")
 
-# Step 2: Loop through the list and remove background
-for image_name in image_files:
+def _init_session():
+    global SESSION
+    # Each worker handles one image at a time, so give it a single ORT thread
+    # instead of letting every worker spin up a thread per core.
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    SESSION = new_session("u2net")
+
+
+def _process_image(image_name):
     start_time = time.time()
 
     input_image = Image.open(image_name)
-    output_image = remove(input_image)
+    output_image = remove(input_image, session=SESSION)
 
     # Create output name
     base_name, _ = os.path.splitext(image_name)
@@ -27,5 +31,30 @@ for image_name in image_files:
 
     output_image.save(output_path)
 
-    elapsed_time = time.time() - start_time
-    print(f"✅ Processed '{image_name}' → '{output_path}' in {elapsed_time:.2f} seconds")
+    return image_name, output_path, time.time() - start_time
+
+
+if __name__ == "__main__":
+    # Step 1: Get all image files in the current directory
+    image_files = [
+        entry.name
+        for entry in os.scandir('.')
+        if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+    ]
+
+    # Print found image files
+    print(f"🖼️ Found {len(image_files)} image(s): {image_files}")
+
+    # Step 2: Remove backgrounds in parallel, one rembg session per worker process.
+    # Workers are spawned rather than forked: onnxruntime and rembg's numba
+    # dependency are not fork-safe and can hang the parent on exit.
+    # Images are handed out one at a time (each takes seconds), so every
+    # worker that pays for loading U²-Net also gets work.
+    if image_files:
+        workers = min(os.cpu_count() or 1, len(image_files))
+        with get_context("spawn").Pool(workers, initializer=_init_session) as pool, \
+                tqdm(total=len(image_files), unit="image") as progress:
+            results = pool.imap_unordered(_process_image, image_files, chunksize=1)
+            for image_name, output_path, elapsed_time in results:
+                progress.write(f"✅ Processed '{image_name}' → '{output_path}' in {elapsed_time:.2f} seconds")
+                progress.update()
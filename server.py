@@ -4,17 +4,27 @@ This server accepts image uploads and returns the processed image with backgroun
 """
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
-from rembg import remove
-from PIL import Image
+from werkzeug.exceptions import HTTPException
+import onnxruntime as ort
+import blake3
+import numpy as np
+import pyvips
+from rembg.sessions.u2net import U2netSession
+import base64
+import binascii
 import io
 import os
+import tempfile
 from datetime import datetime
 
-from typing import Optional
+from typing import BinaryIO, List, Optional, Tuple, Union
 
+from mask_batcher import MaskBatcher
 from user_service import UserService
 
 app = Flask(__name__)
+# Reject oversized uploads with 413 before they are buffered; see handle_http_error
+app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024
 # Enable CORS for Flutter app
 CORS(app)
 
@@ -24,10 +34,373 @@ user_service = UserService()
 # Configuration
 UPLOAD_FOLDER = "uploads"
 OUTPUT_FOLDER = "processed_images"
+# Encoded results keyed by the BLAKE3 hash of the upload, so retried uploads
+# skip U²-Net entirely; one subfolder per model (see MODEL_CACHE_FOLDER)
+CACHE_FOLDER = "response_cache"
+
+# Execution device for U²-Net inference: "cuda" (falls back to CPU when
+# CUDA is unavailable), "tensorrt" to try TensorRT first, or "cpu" to force
+# the CPU provider.
+REMBG_DEVICE = os.environ.get("REMBG_DEVICE", "cuda").lower()
+
+# Optional converted model (u2net_fp16.onnx from convert_u2net_fp16.py or
+# u2net_int8.onnx from quantize_u2net_int8.py); rembg's FP32 u2net.onnx is
+# used when unset.
+REMBG_MODEL_PATH = os.environ.get("REMBG_MODEL_PATH")
+
+# gunicorn worker processes (see gunicorn.conf.py); on CPU each process's
+# session gets its share of the cores instead of one thread per core each.
+WORKER_PROCESSES = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+# Built TensorRT engines are cached here to skip the multi-minute warmup
+TRT_CACHE_DIR = os.environ.get("REMBG_TRT_CACHE", "trt_cache")
+
+# Micro-batching: concurrent requests arriving within MAX_WAIT seconds share
+# one U²-Net run of up to MAX_BATCH images.
+MAX_BATCH = int(os.environ.get("REMBG_MAX_BATCH", "8"))
+MAX_WAIT = 0.01
+
+# U²-Net input size and ImageNet normalization used by rembg
+MODEL_INPUT_SIZE = 320
+MODEL_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+MODEL_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# `?preview=1` responses are decoded shrunk to fit within this square, so the
+# full-resolution upload is never expanded
+PREVIEW_SIZE = 1024
+
+# zlib level for PNG responses; Pillow's default of 6 makes encoding the hot
+# loop, level 1 trades a slightly larger file for a much faster encode.
+PNG_COMPRESSION = 1
+
+# Output formats clients can request with `?format=...`, with their mimetypes
+OUTPUT_FORMATS = {"png": "image/png", "webp": "image/webp"}
 
 # Create necessary directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+
+
+def _model_input_name(model_path: str) -> str:
+    """
+    Name of the model's image input, read from the ONNX graph without
+    building a session.
+
+    onnx is only needed for the TensorRT setup (see SERVER_SETUP.md), so it is
+    imported here rather than at module level.
+
+    Example:
+        >>> _model_input_name(U2netSession.download_models())
+        'input.1'
+    """
+    import onnx
+
+    graph = onnx.load(model_path, load_external_data=False).graph
+    initializers = {initializer.name for initializer in graph.initializer}
+    return next(
+        graph_input.name
+        for graph_input in graph.input
+        if graph_input.name not in initializers
+    )
+
+
+def _execution_providers(model_path: str) -> List[Union[str, Tuple[str, dict]]]:
+    """
+    Ordered onnxruntime providers for REMBG_DEVICE, limited to those
+    installed so a CPU-only box still starts.
+
+    For TensorRT the engine is built with an optimization profile covering
+    batch sizes 1..MAX_BATCH, so batches from MaskBatcher never fall outside
+    it and trigger an engine rebuild while serving.
+
+    Example:
+        >>> _execution_providers(U2netSession.download_models())
+        ['CUDAExecutionProvider', 'CPUExecutionProvider']
+    """
+    if REMBG_DEVICE == "cpu":
+        providers: List[Union[str, Tuple[str, dict]]] = ["CPUExecutionProvider"]
+    else:
+        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+
+    if REMBG_DEVICE == "tensorrt":
+        os.makedirs(TRT_CACHE_DIR, exist_ok=True)
+        input_name = _model_input_name(model_path)
+        image_shape = f"3x{MODEL_INPUT_SIZE}x{MODEL_INPUT_SIZE}"
+        providers.insert(
+            0,
+            (
+                "TensorrtExecutionProvider",
+                {
+                    "trt_fp16_enable": True,
+                    "trt_engine_cache_enable": True,
+                    "trt_engine_cache_path": TRT_CACHE_DIR,
+                    "trt_profile_min_shapes": f"{input_name}:1x{image_shape}",
+                    "trt_profile_max_shapes": f"{input_name}:{MAX_BATCH}x{image_shape}",
+                    # Tune for full batches, which is when throughput matters
+                    "trt_profile_opt_shapes": f"{input_name}:{MAX_BATCH}x{image_shape}",
+                },
+            ),
+        )
+
+    available = ort.get_available_providers()
+    return [
+        provider
+        for provider in providers
+        if (provider[0] if isinstance(provider, tuple) else provider) in available
+    ]
+
+
+def _model_path() -> str:
+    """
+    U²-Net model file to load: REMBG_MODEL_PATH, or rembg's downloaded
+    u2net.onnx when unset.
+    """
+    if REMBG_MODEL_PATH:
+        return os.path.abspath(os.path.expanduser(REMBG_MODEL_PATH))
+    return U2netSession.download_models()
+
+
+def _model_cache_folder(model_path: str) -> str:
+    """
+    Response cache subfolder for a model, keyed by the BLAKE3 hash of the
+    model file so neither switching REMBG_MODEL_PATH nor re-running
+    convert_u2net_fp16.py / quantize_u2net_int8.py over the same file serves
+    results produced by a different model.
+
+    The file is hashed once at startup in 1 MiB chunks.
+
+    Example:
+        >>> _model_cache_folder("/root/.u2net/u2net_fp16.onnx")
+        "response_cache/u2net_fp16-9c3e51f07a2b64d8"
+    """
+    hasher = blake3.blake3()
+    with open(model_path, "rb") as model_file:
+        for chunk in iter(lambda: model_file.read(1 << 20), b""):
+            hasher.update(chunk)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(CACHE_FOLDER, f"{stem}-{hasher.hexdigest()[:16]}")
+
+
+def _create_inference_session(model_path: str) -> ort.InferenceSession:
+    """
+    Build the shared U²-Net session with full graph optimizations enabled.
+
+    The providers list is explicit because onnxruntime otherwise silently runs
+    on the CPU even when `rembg[gpu]` is installed. The providers that were
+    actually registered are printed so a missing CUDA setup is visible.
+
+    The session is created with onnxruntime directly rather than through
+    rembg, whose session classes always load their own downloaded model and
+    so cannot run a converted model from REMBG_MODEL_PATH.
+
+    Example:
+        $ REMBG_DEVICE=tensorrt REMBG_MODEL_PATH=~/.u2net/u2net_fp16.onnx python server.py
+    """
+    sess_opts = ort.SessionOptions()
+    sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if WORKER_PROCESSES > 1:
+        sess_opts.intra_op_num_threads = max(1, (os.cpu_count() or 1) // WORKER_PROCESSES)
+
+    session = ort.InferenceSession(
+        model_path,
+        sess_options=sess_opts,
+        providers=_execution_providers(model_path),
+    )
+    print(f"🧠 rembg model: {model_path}")
+    print(f"🧠 rembg providers: {session.get_providers()}")
+    return session
+
+
+# Load the U²-Net model once so requests reuse the same ONNX runtime session
+MODEL_PATH = _model_path()
+SESSION = _create_inference_session(MODEL_PATH)
+BATCHER = MaskBatcher(SESSION, max_batch=MAX_BATCH, max_wait=MAX_WAIT)
+
+MODEL_CACHE_FOLDER = _model_cache_folder(MODEL_PATH)
+os.makedirs(MODEL_CACHE_FOLDER, exist_ok=True)
+
+
+def _load_rgb(data: Union[bytes, BinaryIO], max_size: Optional[int] = None) -> pyvips.Image:
+    """
+    Decode an uploaded image with libvips into an upright 8-bit sRGB image.
+
+    `data` is either the encoded bytes or a seekable file-like object such as
+    Werkzeug's `FileStorage.stream`; streams are read by libvips directly so
+    the upload is never copied into a separate `bytes` object.
+
+    With `max_size`, larger images are shrunk while decoding (JPEG and WebP
+    shrink-on-load) to fit within `max_size`×`max_size`; smaller ones are
+    left as they are. The result is decoded into memory before returning.
+
+    Example:
+        >>> _load_rgb(open("shirt.jpg", "rb")).bands
+        3
+        >>> image = _load_rgb(open("portrait_3000x4000.jpg", "rb"), max_size=1024)
+        >>> image.width, image.height
+        (768, 1024)
+    """
+    if isinstance(data, bytes):
+        if max_size:
+            image = pyvips.Image.thumbnail_buffer(
+                data, max_size, height=max_size, size="down"
+            )
+        else:
+            image = pyvips.Image.new_from_buffer(data, "")
+    else:
+        source = pyvips.SourceCustom()
+        source.on_read(data.read)
+        source.on_seek(data.seek)
+        if max_size:
+            image = pyvips.Image.thumbnail_source(
+                source, max_size, height=max_size, size="down"
+            )
+        else:
+            image = pyvips.Image.new_from_source(source, "")
+
+    image = image.autorot()
+    image = image.colourspace("srgb")
+    if image.hasalpha():
+        image = image.extract_band(0, n=3)
+    if image.format != "uchar":
+        image = image.cast("uchar")
+    if max_size:
+        # Thumbnails are small and usually read more than once, so decode
+        # them into memory now. For streams this also finishes every read
+        # while `source` is still referenced; unlike new_from_source,
+        # thumbnail_source does not keep the Python callbacks alive.
+        image = image.copy_memory()
+    return image
+
+
+def _to_model_input(image: pyvips.Image) -> np.ndarray:
+    """
+    Resize to the U²-Net input size and normalize like rembg does.
+
+    Returns:
+        float32 tensor shaped `(3, 320, 320)`.
+    """
+    small = image.thumbnail_image(
+        MODEL_INPUT_SIZE, height=MODEL_INPUT_SIZE, size="force"
+    )
+    pixels = np.ndarray(
+        buffer=small.write_to_memory(),
+        dtype=np.uint8,
+        shape=(small.height, small.width, small.bands),
+    )
+    scaled = pixels / max(int(pixels.max()), 1)
+    return ((scaled - MODEL_MEAN) / MODEL_STD).transpose((2, 0, 1)).astype(np.float32)
+
+
+def _remove_background(data: Union[bytes, BinaryIO], preview: bool = False) -> pyvips.Image:
+    """
+    Cut the foreground out of an uploaded image using the shared micro-batcher.
+
+    Previews are decoded to fit within `PREVIEW_SIZE`×`PREVIEW_SIZE`,
+    otherwise the upload is decoded once at full resolution. The raw
+    prediction is min-max scaled into a mask, resized back to the decoded
+    size with Lanczos and attached as the alpha channel.
+
+    Example:
+        >>> cutout = _remove_background(upload_bytes, preview=True)
+        >>> cutout.pngsave_buffer(compression=PNG_COMPRESSION)
+    """
+    if preview:
+        image = _load_rgb(data, max_size=PREVIEW_SIZE)
+    else:
+        image = _load_rgb(data)
+    pred = BATCHER.submit(_to_model_input(image)).result()
+
+    ma = np.max(pred)
+    mi = np.min(pred)
+    pred = (pred - mi) / max(ma - mi, 1e-6)
+
+    mask_bytes = (pred * 255).astype(np.uint8).tobytes()
+    mask = pyvips.Image.new_from_memory(
+        mask_bytes, MODEL_INPUT_SIZE, MODEL_INPUT_SIZE, 1, "uchar"
+    )
+    mask = mask.thumbnail_image(image.width, height=image.height, size="force")
+
+    return image.bandjoin(mask)
+
+
+def _encode_output(image: pyvips.Image, output_format: str) -> Tuple[bytes, str]:
+    """
+    Encode a cutout as PNG or lossless WebP and return it with its mimetype.
+
+    Lossless WebP at effort 0 uses libwebp's SIMD VP8L encoder and is usually
+    both faster and smaller than PNG for masked cutouts.
+
+    Example:
+        >>> _encode_output(cutout, "webp")
+        (b"RIFF...", "image/webp")
+    """
+    if output_format == "webp":
+        return image.webpsave_buffer(lossless=True, effort=0), OUTPUT_FORMATS["webp"]
+    return image.pngsave_buffer(compression=PNG_COMPRESSION), OUTPUT_FORMATS["png"]
+
+
+def _requested_format() -> Optional[str]:
+    """
+    Read the `format` query parameter, defaulting to PNG.
+
+    Returns None for unsupported values so the route can reject them.
+    """
+    output_format = request.args.get("format", "png").lower()
+    return output_format if output_format in OUTPUT_FORMATS else None
+
+
+def _requested_preview() -> bool:
+    """
+    Whether the client asked for a `PREVIEW_SIZE` result with `?preview=1`.
+    """
+    return request.args.get("preview") == "1"
+
+
+def _hash_stream(stream: BinaryIO) -> str:
+    """
+    BLAKE3 hex digest of a seekable stream, read in 1 MiB chunks and rewound
+    afterwards so it can still be decoded.
+
+    Example:
+        >>> _hash_stream(request.files["image"].stream)
+        "af1349b9f5f9a1a6..."
+    """
+    hasher = blake3.blake3()
+    for chunk in iter(lambda: stream.read(1 << 20), b""):
+        hasher.update(chunk)
+    stream.seek(0)
+    return hasher.hexdigest()
+
+
+def _cache_path(digest: str, output_format: str, preview: bool = False) -> str:
+    """
+    Location of the cached response for an upload digest and output format.
+
+    Example:
+        >>> _cache_path("af1349b9", "png")
+        "response_cache/u2net-60f2a1c4d8e93b57/af1349b9.png"
+        >>> _cache_path("af1349b9", "png", preview=True)
+        "response_cache/u2net-60f2a1c4d8e93b57/af1349b9.preview.png"
+    """
+    suffix = "preview." if preview else ""
+    return os.path.join(MODEL_CACHE_FOLDER, f"{digest}.{suffix}{output_format}")
+
+
+def _store_cached(path: str, data: bytes) -> None:
+    """
+    Write a response to the cache atomically so concurrent requests never
+    read a partially written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        # Only left behind when the write or rename failed
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
 
 
 def _extract_token(auth_header: Optional[str]) -> Optional[str]:
@@ -46,6 +419,22 @@ def _extract_token(auth_header: Optional[str]) -> Optional[str]:
     return None
 
 
+@app.errorhandler(HTTPException)
+def handle_http_error(error: HTTPException):
+    """
+    Answer HTTP errors with the same `{"error": ...}` JSON as the routes.
+
+    Covers errors Werkzeug raises while a route reads the request, such as
+    413 for uploads over MAX_CONTENT_LENGTH or 400/415 for a missing or
+    malformed JSON body, instead of its default HTML pages.
+    """
+    if error.code == 413:
+        message = "Image exceeds the 25 MB upload limit"
+    else:
+        message = error.description
+    return jsonify({"error": message}), error.code
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
@@ -171,13 +560,18 @@ def remove_background():
     Remove background from uploaded image.
     
     Expects: multipart/form-data with 'image' field containing the image file
-    Returns: Processed image with background removed (PNG format)
+    Returns: Processed image with background removed (PNG format, or lossless
+        WebP with `?format=webp`); `?preview=1` fits it within 1024×1024
     
     Example usage:
         curl -X POST http://localhost:5045/remove-background \
              -F "image=@path/to/image.jpg"
     """
     try:
+        output_format = _requested_format()
+        if output_format is None:
+            return jsonify({"error": "Unsupported output format"}), 400
+        
         # Check if image file is present in request
         if 'image' not in request.files:
             return jsonify({"error": "No image file provided"}), 400
@@ -188,25 +582,35 @@ def remove_background():
         if file.filename == '':
             return jsonify({"error": "No file selected"}), 400
         
-        # Read the image file
-        input_image = Image.open(io.BytesIO(file.read()))
+        # Serve repeat uploads straight from the cache
+        preview = _requested_preview()
+        cached_path = _cache_path(_hash_stream(file.stream), output_format, preview)
+        if os.path.exists(cached_path):
+            return send_file(
+                os.path.abspath(cached_path),
+                mimetype=OUTPUT_FORMATS[output_format],
+                as_attachment=False,
+                download_name=f'processed_image.{output_format}'
+            )
         
-        # Remove background using rembg
-        output_image = remove(input_image)
+        # Decode with libvips and remove background using the batched U²-Net session
+        output_image = _remove_background(file.stream, preview)
         
-        # Convert to bytes
-        img_byte_arr = io.BytesIO()
-        output_image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
+        # Encode as PNG or WebP
+        output_bytes, mimetype = _encode_output(output_image, output_format)
+        _store_cached(cached_path, output_bytes)
         
         # Return the processed image
         return send_file(
-            img_byte_arr,
-            mimetype='image/png',
+            io.BytesIO(output_bytes),
+            mimetype=mimetype,
             as_attachment=False,
-            download_name='processed_image.png'
+            download_name=f'processed_image.{output_format}'
         )
     
+    except HTTPException:
+        # Answered as JSON by handle_http_error with their own status code
+        raise
     except Exception as e:
         return jsonify({"error": f"Error processing image: {str(e)}"}), 500
 
@@ -218,6 +622,8 @@ def remove_background_base64():
     
     Expects: JSON with 'image' field containing base64 encoded image string
     Returns: JSON with 'image' field containing base64 encoded processed image
+        (PNG, or lossless WebP with `?format=webp`); `?preview=1` fits it
+        within 1024×1024
     
     Example usage:
         {
@@ -225,55 +631,56 @@ def remove_background_base64():
         }
     """
     try:
+        output_format = _requested_format()
+        if output_format is None:
+            return jsonify({"error": "Unsupported output format"}), 400
+        
         data = request.get_json()
         
         if not data or 'image' not in data:
             return jsonify({"error": "No image data provided"}), 400
         
-        image_data = data['image']
+        image_data = data['image'].encode('ascii')
         
-        # Remove data URL prefix if present
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
+        # Skip the data URL prefix if present without copying the payload
+        payload_start = image_data.find(b',') + 1
         
         # Decode base64 image
-        import base64
-        image_bytes = base64.b64decode(image_data)
-        
-        # Open image
-        input_image = Image.open(io.BytesIO(image_bytes))
+        image_bytes = binascii.a2b_base64(memoryview(image_data)[payload_start:])
         
-        # Remove background
-        output_image = remove(input_image)
+        # Reuse the cached result for repeat uploads
+        preview = _requested_preview()
+        cached_path = _cache_path(
+            blake3.blake3(image_bytes).hexdigest(), output_format, preview
+        )
+        if os.path.exists(cached_path):
+            with open(cached_path, "rb") as cached_file:
+                output_bytes = cached_file.read()
+            mimetype = OUTPUT_FORMATS[output_format]
+        else:
+            # Decode image and remove background
+            output_image = _remove_background(image_bytes, preview)
+            
+            # Encode and cache
+            output_bytes, mimetype = _encode_output(output_image, output_format)
+            _store_cached(cached_path, output_bytes)
         
         # Convert to base64
-        img_byte_arr = io.BytesIO()
-        output_image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-        
-        output_base64 = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
+        output_base64 = base64.b64encode(output_bytes).decode('utf-8')
         
         return jsonify({
             "success": True,
-            "image": f"data:image/png;base64,{output_base64}"
+            "image": f"data:{mimetype};base64,{output_base64}"
         })
     
+    except HTTPException:
+        # Answered as JSON by handle_http_error with their own status code
+        raise
     except Exception as e:
         return jsonify({"error": f"Error processing image: {str(e)}"}), 500
 
 
 if __name__ == '__main__':
-    # Use port 5045 to avoid conflict with macOS AirPlay Receiver on port 5000
-    PORT = 5045
-    
-    print("🚀 Starting Background Removal Server...")
-    print(f"📍 Server will be available at: http://localhost:{PORT}")
-    print(f"📡 Health check: http://localhost:{PORT}/health")
-    print(f"🖼️  Remove background: http://localhost:{PORT}/remove-background")
-    print("\n⚠️  Make sure your Flutter app is configured to connect to this server!")
-    print(f"   For Android emulator, use: http://10.0.2.2:{PORT}")
-    print(f"   For iOS simulator, use: http://localhost:{PORT}")
-    print(f"   For physical device, use your computer's IP address (e.g., http://192.168.1.100:{PORT})\n")
-    
-    app.run(host='0.0.0.0', port=PORT, debug=True)
-
+    # Local development only; use `gunicorn -c gunicorn.conf.py wsgi:app` to serve.
+    # Port 5045 avoids the conflict with macOS AirPlay Receiver on port 5000.
+    app.run(host='0.0.0.0', port=5045, threaded=True)
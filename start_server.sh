@@ -1,7 +1,7 @@
 #!/bin/bash
 
 # Quick start script for the background removal server
-# This script checks dependencies and starts the Flask server
+# This script checks dependencies and starts the Flask app under gunicorn
 
 echo "🚀 Starting Background Removal Server..."
 echo ""
@@ -30,11 +30,17 @@ if ! python3 -c "import rembg" 2>/dev/null; then
     pip3 install -r requirements.txt
 fi
 
+if ! python3 -c "import gunicorn" 2>/dev/null; then
+    echo "⚠️  gunicorn not found. Installing dependencies..."
+    pip3 install -r requirements.txt
+fi
+
 echo "✅ Dependencies checked"
 echo ""
 echo "🌐 Starting server..."
 echo ""
 
 # Start the server
-python3 server.py
+echo "📍 Server will be available at: http://localhost:5045"
+exec python3 -m gunicorn -c gunicorn.conf.py wsgi:app
 
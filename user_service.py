@@ -8,14 +8,20 @@ bookkeeping directly.
 from __future__ import annotations
 
 import os
+import secrets
 import sqlite3
-import uuid
-from datetime import datetime
-from typing import List, Optional
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
+import blake3
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 
+# user_images.uploaded_at is stored as integer microseconds since this epoch
+_EPOCH = datetime(1970, 1, 1)
+
 
 class UserService:
     """
@@ -33,8 +39,16 @@ class UserService:
 
     The class automatically creates all required folders and database tables
     on first use, which makes it ideal for demos and local development.
+
+    Token lookups are cached in memory for `TOKEN_CACHE_TTL` seconds so
+    authenticated requests usually skip SQLite. Each process has its own
+    cache, so with several gunicorn workers a rotated token can stay valid in
+    another worker until its entry expires.
     """
 
+    TOKEN_CACHE_TTL = 60.0
+    TOKEN_CACHE_SIZE = 1024
+
     def __init__(
         self,
         db_path: str = "/Volumes/Development/projects/Python/remove_bg_image/data/users.db",
@@ -55,6 +69,8 @@ class UserService:
         """
         self.db_path = db_path
         self.user_upload_root = user_upload_root
+        self._local = threading.local()
+        self._token_cache: Dict[bytes, Tuple[sqlite3.Row, float]] = {}
 
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         os.makedirs(self.user_upload_root, exist_ok=True)
@@ -62,14 +78,25 @@ class UserService:
 
     def _get_connection(self) -> sqlite3.Connection:
         """
-        Create a new SQLite connection so every request stays isolated.
+        Return this thread's SQLite connection, opening it on first use.
+
+        Connections are kept per thread (SQLite objects cannot cross threads)
+        and reused across requests, so the open, the PRAGMA setup and the
+        statement cache of `sqlite3` are paid once per thread instead of per
+        call. WAL lets readers proceed while another thread writes.
 
         Example:
             >>> with service._get_connection() as conn:
             ...     conn.execute("SELECT 1")
         """
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            conn.execute("PRAGMA temp_store=MEMORY;")
+            self._local.conn = conn
         return conn
 
     def _initialize_database(self) -> None:
@@ -77,33 +104,108 @@ class UserService:
         Create tables needed for users and their images if they do not exist.
 
         This keeps setup zero-config. The routine can safely run multiple times.
+        Older databases that stored `user_images.uploaded_at` as ISO text are
+        migrated to integer microseconds, and raw `users.auth_token` values
+        are replaced by the `auth_token_hash` column, on the way.
+
+        Every gunicorn worker runs this at import, so the schema is inspected
+        and migrated inside one `BEGIN IMMEDIATE` transaction: the first worker
+        takes the write lock, the others wait for it and then find the
+        migrated tables.
         """
-        with self._get_connection() as conn:
+        conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
             cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE;")
+            try:
+                self._create_tables(cursor)
+                cursor.execute("COMMIT;")
+            except BaseException:
+                cursor.execute("ROLLBACK;")
+                raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create_tables(cursor: sqlite3.Cursor) -> None:
+        """
+        Create or migrate the tables; callers must hold the write lock.
+        """
+        # A TEXT column would coerce new integers back into strings, so
+        # legacy tables are rebuilt rather than updated in place.
+        legacy_images = any(
+            column["name"] == "uploaded_at" and column["type"].upper() == "TEXT"
+            for column in cursor.execute("PRAGMA table_info(user_images);")
+        )
+        if legacy_images:
+            cursor.execute("ALTER TABLE user_images RENAME TO user_images_legacy;")
+
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                auth_token_hash BLOB,
+                created_at TEXT NOT NULL
+            );
+            """
+        )
+        # Older databases kept raw tokens in `auth_token`; add the hash
+        # column and clear the raw values so they can no longer be used.
+        user_columns = {
+            column["name"] for column in cursor.execute("PRAGMA table_info(users);")
+        }
+        if "auth_token_hash" not in user_columns:
+            cursor.execute("ALTER TABLE users ADD COLUMN auth_token_hash BLOB;")
+            cursor.execute("UPDATE users SET auth_token = NULL;")
+        cursor.execute("DROP INDEX IF EXISTS idx_users_token;")
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_users_token_hash
+            ON users (auth_token_hash);
+            """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS user_images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                original_filename TEXT NOT NULL,
+                stored_path TEXT NOT NULL,
+                uploaded_at INTEGER NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            );
+            """
+        )
+        if legacy_images:
             cursor.execute(
                 """
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    auth_token TEXT,
-                    created_at TEXT NOT NULL
-                );
-                """
-            )
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS user_images (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    original_filename TEXT NOT NULL,
-                    stored_path TEXT NOT NULL,
-                    uploaded_at TEXT NOT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                );
+                INSERT INTO user_images (
+                    id,
+                    user_id,
+                    original_filename,
+                    stored_path,
+                    uploaded_at
+                )
+                SELECT
+                    id,
+                    user_id,
+                    original_filename,
+                    stored_path,
+                    CAST(strftime('%s', uploaded_at) AS INTEGER) * 1000000
+                        + CAST(substr(uploaded_at, 21, 6) AS INTEGER)
+                FROM user_images_legacy;
                 """
             )
-            conn.commit()
+            cursor.execute("DROP TABLE user_images_legacy;")
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_user_images_user_uploaded
+            ON user_images (user_id, uploaded_at DESC);
+            """
+        )
 
     def register_user(self, username: str, password: str) -> bool:
         """
@@ -139,15 +241,18 @@ class UserService:
         """
         Verify credentials and return a fresh auth token.
 
+        Only a 16-byte BLAKE3 digest of the token is stored, so a leaked
+        database does not expose usable tokens.
+
         Example:
             >>> token = service.login_user("alex", "StrongPass!23")
             >>> print(token)
-            "8230a4b1..."  # token string
+            "pX3r9Kc1..."  # token string
         """
         normalized_username = username.strip().lower()
         with self._get_connection() as conn:
             cursor = conn.execute(
-                "SELECT id, password_hash FROM users WHERE username = ?;",
+                "SELECT id, password_hash, auth_token_hash FROM users WHERE username = ?;",
                 (normalized_username,),
             )
             row = cursor.fetchone()
@@ -155,32 +260,86 @@ class UserService:
             if not row or not check_password_hash(row["password_hash"], password):
                 return None
 
-            token = uuid.uuid4().hex
+            token = secrets.token_urlsafe(24)
             conn.execute(
-                "UPDATE users SET auth_token = ? WHERE id = ?;",
-                (token, row["id"]),
+                "UPDATE users SET auth_token_hash = ? WHERE id = ?;",
+                (self._hash_token(token), row["id"]),
             )
             conn.commit()
-            return token
+
+        # The previous token is no longer valid
+        self._invalidate_token(row["auth_token_hash"])
+        return token
 
     def get_user_by_token(self, token: str) -> Optional[sqlite3.Row]:
         """
         Locate a user row via their auth token to authorize requests.
 
         Example:
-            >>> user = service.get_user_by_token(token="8230a4b1")
+            >>> user = service.get_user_by_token(token="pX3r9Kc1")
             >>> user["username"]
             "alex"
         """
         if not token:
             return None
 
+        token_hash = self._hash_token(token)
+        cached = self._token_cache.get(token_hash)
+        if cached is not None:
+            user, expires_at = cached
+            if expires_at > time.monotonic():
+                return user
+            self._invalidate_token(token_hash)
+
         with self._get_connection() as conn:
             cursor = conn.execute(
-                "SELECT id, username FROM users WHERE auth_token = ?;",
-                (token,),
+                "SELECT id, username FROM users WHERE auth_token_hash = ?;",
+                (token_hash,),
             )
-            return cursor.fetchone()
+            user = cursor.fetchone()
+
+        if user is not None:
+            self._cache_token(token_hash, user)
+        return user
+
+    @staticmethod
+    def _hash_token(token: str) -> bytes:
+        """
+        Fixed-length digest under which a token is stored and looked up.
+
+        Example:
+            >>> len(UserService._hash_token("pX3r9Kc1"))
+            16
+        """
+        return blake3.blake3(token.encode()).digest()[:16]
+
+    def _cache_token(self, token_hash: bytes, user: sqlite3.Row) -> None:
+        """
+        Remember a token lookup, evicting expired and then oldest entries
+        once the cache is full.
+
+        Example:
+            >>> service._cache_token(service._hash_token("pX3r9Kc1"), user)
+        """
+        if len(self._token_cache) >= self.TOKEN_CACHE_SIZE:
+            now = time.monotonic()
+            for cached_token, (_, expires_at) in list(self._token_cache.items()):
+                if expires_at <= now:
+                    self._token_cache.pop(cached_token, None)
+            while len(self._token_cache) >= self.TOKEN_CACHE_SIZE:
+                self._token_cache.pop(next(iter(self._token_cache)), None)
+
+        self._token_cache[token_hash] = (user, time.monotonic() + self.TOKEN_CACHE_TTL)
+
+    def _invalidate_token(self, token_hash: Optional[bytes]) -> None:
+        """
+        Drop a token from the lookup cache, e.g. after it was rotated.
+
+        Example:
+            >>> service._invalidate_token(service._hash_token("pX3r9Kc1"))
+        """
+        if token_hash:
+            self._token_cache.pop(token_hash, None)
 
     def save_user_image(self, user_id: int, username: str, file_storage) -> Optional[str]:
         """
@@ -211,7 +370,8 @@ class UserService:
 
         stored_filename = f"{timestamp}_{safe_filename}"
         stored_path = os.path.join(user_folder, stored_filename)
-        file_storage.save(stored_path)
+        # Stream to disk in 1 MiB chunks instead of Werkzeug's 16 KiB default
+        file_storage.save(stored_path, buffer_size=1 << 20)
 
         relative_path = os.path.relpath(
             stored_path,
@@ -233,7 +393,7 @@ class UserService:
                     user_id,
                     safe_filename,
                     relative_path,
-                    datetime.utcnow().isoformat(),
+                    time.time_ns() // 1000,
                 ),
             )
             conn.commit()
@@ -267,7 +427,9 @@ class UserService:
             {
                 "original_filename": row["original_filename"],
                 "stored_path": row["stored_path"],
-                "uploaded_at": row["uploaded_at"],
+                "uploaded_at": (
+                    _EPOCH + timedelta(microseconds=row["uploaded_at"])
+                ).isoformat(),
             }
             for row in rows
         ]
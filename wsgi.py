@@ -0,0 +1,9 @@
+"""
+WSGI entry point for running the background removal server under gunicorn.
+
+Example:
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from server import app
+
+__all__ = ["app"]